@@ -2,6 +2,9 @@
 
 
 from collections import defaultdict
+import concurrent.futures
+import multiprocessing
+import sys
 
 import build_model
 import options
@@ -13,103 +16,136 @@ PREDICATES_FILE = "predicates.txt"
 STATIC_PREDICATES_FILE = "static-predicates.txt"
 STATIC_ATOMS_FILE = "static-atoms.txt"
 
+# Below this number of action and axiom atoms, starting worker processes
+# costs more than instantiating the atoms serially.
+MIN_ATOMS_FOR_PARALLEL_INSTANTIATION = 10000
+
+# Dump files can contain many atoms, so we write them with a large buffer.
+DUMP_BUFFER_SIZE = 1 << 20
+
+def format_atom(atom):
+    """Return the line for atom in the dump files, e.g., "at(ball1,rooma)".
+
+    We format the line from the predicate and arguments instead of going
+    through str(atom) and stripping the class name and the spaces. Negated
+    atoms are formatted like their positive counterparts.
+    """
+    return "%s(%s)\n" % (atom.predicate, ",".join(atom.args))
+
 def print_atom(atom, file):
-    atom_name = str(atom)
-    assert atom_name.startswith("Atom ")
-    print(atom_name[len("Atom "):].replace(" ", ""), file=file)
+    assert not atom.negated
+    file.write(format_atom(atom))
 
 def print_negated_atom(negated_atom, file):
-    atom_name = str(negated_atom)
-    assert atom_name.startswith("NegatedAtom ")
-    print(atom_name[len("NegatedAtom "):].replace(" ", ""), file=file)
-
-def add_type_predicates(types):
-    result = []
-    for k, l in types.items():
-        for obj in l:
-            result.append("Atom %s(%s)" % (k, obj))
-    return result
+    assert negated_atom.negated
+    file.write(format_atom(negated_atom))
 
 
-def compute_fluent_and_static_predicates(task, model):
-    all_predicates = set()
+def compute_fluent_and_static_predicates(task):
     fluent_predicates = set()
     for action in task.actions:
         for effect in action.effects:
             fluent_predicates.add(effect.literal.predicate)
-            all_predicates.add(effect.literal.predicate)
-        if isinstance(action.precondition, pddl.Conjunction):
-            for precond in action.precondition.parts:
-                all_predicates.add(precond.predicate)
-        else:
-            assert isinstance(action.precondition, pddl.Atom)
-            all_predicates.add(action.precondition.predicate)
     for axiom in task.axioms:
         fluent_predicates.add(axiom.name)
-    static_predicates = all_predicates - fluent_predicates
-    return fluent_predicates, static_predicates
-
-def dump_predicates(task, model):
-    fluent_predicates, _ = compute_fluent_and_static_predicates(task, model)
-    predicate_name_to_predicate = dict()
-    for predicate in task.predicates:
-        predicate_name_to_predicate[predicate.name] = predicate
-    with open(PREDICATES_FILE, "w") as f:
-        for predicate_name in fluent_predicates:
-            predicate = predicate_name_to_predicate[predicate_name]
-            f.write(f"{predicate_name} {len(predicate.arguments)}\n")
-
-def dump_static_predicates(task, model):
+    # A predicate is static if it occurs in a precondition but is not
+    # fluent. Predicates that only occur in effects are fluent.
+    static_predicates = set()
+    conjunction_cls = pddl.Conjunction
+    for action in task.actions:
+        precondition = action.precondition
+        if isinstance(precondition, conjunction_cls):
+            preconds = precondition.parts
+        else:
+            assert isinstance(precondition, pddl.Atom)
+            preconds = [precondition]
+        for precond in preconds:
+            predicate = precond.predicate
+            if predicate not in fluent_predicates:
+                static_predicates.add(predicate)
+    return frozenset(fluent_predicates), frozenset(static_predicates)
+
+def _index_model(model):
+    """Group the atoms of the model by their predicate.
+
+    The groups are ordered by the first occurrence of their predicate in the
+    model and the atoms of each group keep their order from the model.
+    """
+    model_index = defaultdict(list)
+    for atom in model:
+        model_index[atom.predicate].append(atom)
+    return dict(model_index)
+
+def _predicate_arities(task):
+    """Map the name of each predicate of the task to its arity."""
+    return {predicate.name: len(predicate.arguments)
+            for predicate in task.predicates}
+
+def dump_predicates(fluent_predicates, arities):
+    with open(PREDICATES_FILE, "w", buffering=DUMP_BUFFER_SIZE) as f:
+        f.writelines(f"{predicate_name} {arities[predicate_name]}\n"
+                     for predicate_name in fluent_predicates)
+
+def dump_static_predicates(task, static_predicates, arities):
     """Dump all static predicates. """
-    _, static_predicates = compute_fluent_and_static_predicates(task, model)
-    predicate_name_to_predicate = dict()
-    for predicate in task.predicates:
-        predicate_name_to_predicate[predicate.name] = predicate
-    with open(STATIC_PREDICATES_FILE, "w") as f:
-        for predicate_name in sorted(static_predicates):
-            predicate = predicate_name_to_predicate[predicate_name]
-            f.write(f"{predicate_name} {len(predicate.arguments)}\n")
-        for type in task.types:
-            f.write(f"{type.name} 1\n")
-
-def dump_static_atoms(task, model):
+    with open(STATIC_PREDICATES_FILE, "w", buffering=DUMP_BUFFER_SIZE) as f:
+        f.writelines(f"{predicate_name} {arities[predicate_name]}\n"
+                     for predicate_name in sorted(static_predicates))
+        f.writelines(f"{type.name} 1\n" for type in task.types)
+
+def dump_static_atoms(static_predicates, model_index, initial_state_atoms,
+                      types):
     """Dump all atoms belonging to static predicates.
 
     A predicate is static if all its groundings are static. There are predicates
     where only a subset of their groundings are static. We dump static atoms
     belonging to non-static predicates in append_static_atoms() in translate.py.
     """
-    types = get_objects_by_type(task.objects, task.types)
-    type_predicates = add_type_predicates(types)
-    _, static_predicates = compute_fluent_and_static_predicates(task, model)
-    initial_state_atoms = set(task.init)
-    with open(STATIC_ATOMS_FILE, "w") as f:
-        for atom in model:
-            if atom.predicate in static_predicates:
-                assert atom in initial_state_atoms, atom
-                print_atom(atom, file=f)
-        for t in type_predicates:
-            print_atom(t, file=f)
-
-def get_fluent_facts(task, model):
-    fluent_predicates = set()
-    for action in task.actions:
-        for effect in action.effects:
-            fluent_predicates.add(effect.literal.predicate)
-    for axiom in task.axioms:
-        fluent_predicates.add(axiom.name)
-    return {fact for fact in model
-            if fact.predicate in fluent_predicates}
+    # This is the same format as in format_atom(), but specialized for
+    # groups of atoms that share their predicate, which saves a function
+    # call and the formatting of the predicate for each atom.
+    join = ",".join
+    with open(STATIC_ATOMS_FILE, "w", buffering=DUMP_BUFFER_SIZE) as f:
+        # Only visit the groups of static predicates that occur in the
+        # model. Sorting them makes the order of the file deterministic.
+        for predicate in sorted(static_predicates & model_index.keys()):
+            atoms = model_index[predicate]
+            # Check all atoms of the group at once. Unlike a loop over
+            # the atoms, this disappears entirely with -O.
+            assert initial_state_atoms.issuperset(atoms), \
+                set(atoms) - initial_state_atoms
+            prefix = predicate + "("
+            f.writelines(prefix + join(atom.args) + ")\n" for atom in atoms)
+        # Type predicates are unary, so we can write them directly from
+        # the objects without creating atoms first.
+        for type_name, objects in types.items():
+            prefix = type_name + "("
+            f.writelines(prefix + obj + ")\n" for obj in objects)
+
+def _split_init(task):
+    """Split task.init into a frozenset of facts and a dict that maps
+    fluents to their initial values.
+    """
+    init_facts = []
+    init_assignments = {}
+    for element in task.init:
+        if isinstance(element, pddl.Assign):
+            init_assignments[element.fluent] = element.expression
+        else:
+            init_facts.append(element)
+    return frozenset(init_facts), init_assignments
 
 def get_objects_by_type(typed_objects, types):
     result = defaultdict(list)
-    supertypes = {}
+    # Map each type to itself and its supertypes, so that we only need
+    # one lookup per object.
+    type_closure = {}
     for type in types:
-        supertypes[type.name] = type.supertype_names
+        type_closure[type.name] = (type.name, *type.supertype_names)
     for obj in typed_objects:
-        result[obj.type_name].append(obj.name)
-        for type in supertypes[obj.type_name]:
-            result[type].append(obj.name)
+        obj_name = obj.name
+        for type_name in type_closure[obj.type_name]:
+            result[type_name].append(obj_name)
     return result
 
 def instantiate_goal(goal, init_facts, fluent_facts):
@@ -127,75 +163,209 @@ def instantiate_goal(goal, init_facts, fluent_facts):
     # existence of the `Impossible` exceptions should perhaps be
     # implementation details of `pddl`.
     result = []
+
+    # Fast path for the common case of a conjunction of atoms. With an
+    # empty variable mapping, Atom.instantiate() would only recreate each
+    # atom before checking it, so we check the atoms themselves.
+    if isinstance(goal, pddl.Conjunction):
+        parts = goal.parts
+    else:
+        parts = (goal,)
+    atom_cls = pddl.Atom
+    if all(type(part) is atom_cls for part in parts):
+        for atom in parts:
+            if atom in fluent_facts:
+                result.append(atom)
+            elif atom not in init_facts:
+                return None
+        return result
+
     try:
         goal.instantiate({}, init_facts, fluent_facts, result)
     except pddl.conditions.Impossible:
         return None
     return result
 
-def instantiate(task, model):
-    relaxed_reachable = False
-    fluent_facts = get_fluent_facts(task, model)
-    init_facts = set()
-    init_assignments = {}
-    for element in task.init:
-        if isinstance(element, pddl.Assign):
-            init_assignments[element.fluent] = element.expression
-        else:
-            init_facts.add(element)
+def _instantiate_actions(action, atoms, context):
+    init_facts, init_assignments, fluent_facts, type_to_objects, \
+        use_min_cost_metric = context
+    # This loop is hot, so we bind bound methods and attributes to
+    # locals up front.
+    result = []
+    add_inst_action = result.append
+    parameter_names = tuple(par.name for par in action.parameters)
+    instantiate_action = action.instantiate
+    for atom in atoms:
+        variable_mapping = dict(zip(parameter_names, atom.args))
+        inst_action = instantiate_action(
+            variable_mapping, init_facts, init_assignments,
+            fluent_facts, type_to_objects, use_min_cost_metric)
+        if inst_action:
+            add_inst_action(inst_action)
+    return result
 
-    type_to_objects = get_objects_by_type(task.objects, task.types)
+def _instantiate_axioms(axiom, atoms, context):
+    init_facts, _, fluent_facts, _, _ = context
+    result = []
+    add_inst_axiom = result.append
+    parameter_names = tuple(par.name for par in axiom.parameters)
+    instantiate_axiom = axiom.instantiate
+    for atom in atoms:
+        variable_mapping = dict(zip(parameter_names, atom.args))
+        inst_axiom = instantiate_axiom(
+            variable_mapping, init_facts, fluent_facts)
+        if inst_axiom:
+            add_inst_axiom(inst_axiom)
+    # Sort each group (or chunk) on its own. This happens in the workers
+    # when instantiating in parallel, and the final sort in instantiate()
+    # only has to merge the sorted runs.
+    result.sort()
+    return result
 
-    instantiated_actions = []
-    instantiated_axioms = []
-    reachable_action_parameters = defaultdict(list)
-    for atom in model:
-        if isinstance(atom.predicate, pddl.Action):
-            action = atom.predicate
-            parameters = action.parameters
-            inst_parameters = atom.args[:len(parameters)]
-            # Note: It's important that we use the action object
-            # itself as the key in reachable_action_parameters (rather
-            # than action.name) since we can have multiple different
-            # actions with the same name after normalization, and we
-            # want to distinguish their instantiations.
-            reachable_action_parameters[action].append(inst_parameters)
-            variable_mapping = {par.name: arg
-                                for par, arg in zip(parameters, atom.args)}
-            inst_action = action.instantiate(
-                variable_mapping, init_facts, init_assignments,
-                fluent_facts, type_to_objects,
-                task.use_min_cost_metric)
-            if inst_action:
-                instantiated_actions.append(inst_action)
-        elif isinstance(atom.predicate, pddl.Axiom):
-            axiom = atom.predicate
-            variable_mapping = {par.name: arg
-                                for par, arg in zip(axiom.parameters, atom.args)}
-            inst_axiom = axiom.instantiate(variable_mapping, init_facts, fluent_facts)
-            if inst_axiom:
-                instantiated_axioms.append(inst_axiom)
-        elif atom.predicate == "@goal-reachable":
+# Set by _instantiate_in_parallel() before the worker processes are
+# forked, so that the workers inherit it instead of unpickling it.
+_parallel_state = None
+
+def _instantiate_chunk(is_action, group_index, start, end):
+    action_groups, axiom_groups, context = _parallel_state
+    if is_action:
+        action, atoms = action_groups[group_index]
+        return _instantiate_actions(action, atoms[start:end], context)
+    else:
+        axiom, atoms = axiom_groups[group_index]
+        return _instantiate_axioms(axiom, atoms[start:end], context)
+
+def _instantiate_in_parallel(action_groups, axiom_groups, context,
+                             num_processes, num_atoms):
+    """Instantiate the action and axiom atoms with a pool of processes.
+
+    The atoms are split into chunks that are instantiated independently
+    and the results are concatenated in the same order as in the serial
+    case. We have to fork the workers: conditions cache hash values that
+    depend on the ids of their classes, which only agree between
+    processes that share the address space of the parent.
+    """
+    global _parallel_state
+    # Use several chunks per process to balance the load.
+    chunk_size = max(1, -(-num_atoms // (4 * num_processes)))
+    chunks = []
+    for is_action, groups in [(True, action_groups), (False, axiom_groups)]:
+        for group_index, (_, atoms) in enumerate(groups):
+            for start in range(0, len(atoms), chunk_size):
+                chunks.append((is_action, group_index,
+                               start, start + chunk_size))
+    _parallel_state = (action_groups, axiom_groups, context)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=num_processes,
+                mp_context=multiprocessing.get_context("fork")) as executor:
+            futures = [executor.submit(_instantiate_chunk, *chunk)
+                       for chunk in chunks]
+            instantiated_actions = []
+            instantiated_axioms = []
+            for (is_action, _, _, _), future in zip(chunks, futures):
+                if is_action:
+                    instantiated_actions += future.result()
+                else:
+                    instantiated_axioms += future.result()
+    finally:
+        _parallel_state = None
+    return instantiated_actions, instantiated_axioms
+
+def instantiate(task, model_index, fluent_predicates,
+                init_facts, init_assignments, type_to_objects):
+    relaxed_reachable = False
+
+    # Classify the predicates of the model rather than its atoms. Action
+    # and Axiom have no subclasses, so we can compare types by identity
+    # instead of using isinstance(). Instantiating an action or axiom
+    # requires the complete set of fluent facts, so this happens after
+    # the classification.
+    fluent_facts = set()
+    action_groups = []
+    axiom_groups = []
+    action_cls = pddl.Action
+    axiom_cls = pddl.Axiom
+    for predicate, atoms in model_index.items():
+        predicate_cls = type(predicate)
+        if predicate_cls is action_cls:
+            action_groups.append((predicate, atoms))
+        elif predicate_cls is axiom_cls:
+            axiom_groups.append((predicate, atoms))
+        elif predicate in fluent_predicates:
+            fluent_facts.update(atoms)
+        elif predicate == "@goal-reachable":
             relaxed_reachable = True
 
+    # Each action has exactly one group, so we can fill in the list of
+    # reachable parameters in one go. Actions without reachable
+    # instantiations have no entry.
+    reachable_action_parameters = {}
+    for action, atoms in action_groups:
+        num_parameters = len(action.parameters)
+        # Note: It's important that we use the action object
+        # itself as the key in reachable_action_parameters (rather
+        # than action.name) since we can have multiple different
+        # actions with the same name after normalization, and we
+        # want to distinguish their instantiations.
+        reachable_action_parameters[action] = [
+            atom.args[:num_parameters] for atom in atoms]
+
+    context = (init_facts, init_assignments, fluent_facts, type_to_objects,
+               task.use_min_cost_metric)
+    num_atoms = (sum(len(atoms) for _, atoms in action_groups) +
+                 sum(len(atoms) for _, atoms in axiom_groups))
+    if (options.instantiation_processes > 1 and
+            num_atoms >= MIN_ATOMS_FOR_PARALLEL_INSTANTIATION and
+            # Forking is unsafe on macOS, so only use it on Linux.
+            sys.platform.startswith("linux") and
+            # ProcessPoolExecutor only accepts mp_context from Python 3.7 on.
+            sys.version_info >= (3, 7)):
+        instantiated_actions, instantiated_axioms = _instantiate_in_parallel(
+            action_groups, axiom_groups, context,
+            options.instantiation_processes, num_atoms)
+    else:
+        instantiated_actions = []
+        for action, atoms in action_groups:
+            instantiated_actions += _instantiate_actions(action, atoms, context)
+        instantiated_axioms = []
+        for axiom, atoms in axiom_groups:
+            instantiated_axioms += _instantiate_axioms(axiom, atoms, context)
+
     instantiated_goal = instantiate_goal(task.goal, init_facts, fluent_facts)
 
+    # The axioms consist of sorted runs, one per group or chunk. Timsort
+    # detects these runs and merges them without comparing within them.
+    instantiated_axioms.sort()
+
     return (relaxed_reachable, fluent_facts,
             instantiated_actions, instantiated_goal,
-            sorted(instantiated_axioms), reachable_action_parameters)
+            instantiated_axioms, reachable_action_parameters)
 
 
 def explore(task):
     prog = pddl_to_prolog.translate(task)
     model = build_model.compute_model(prog)
+    # We compute these once and pass them to the functions that need them.
+    # Only the index is kept, so the model itself can be freed early.
+    fluent_predicates, static_predicates = \
+        compute_fluent_and_static_predicates(task)
+    model_index = _index_model(model)
+    del model
+    init_facts, init_assignments = _split_init(task)
+    type_to_objects = get_objects_by_type(task.objects, task.types)
+    if options.dump_predicates or options.dump_static_predicates:
+        arities = _predicate_arities(task)
     if options.dump_predicates:
-        dump_predicates(task, model)
+        dump_predicates(fluent_predicates, arities)
     if options.dump_static_predicates:
-        dump_static_predicates(task, model)
+        dump_static_predicates(task, static_predicates, arities)
     if options.dump_static_atoms:
-        dump_static_atoms(task, model)
+        dump_static_atoms(static_predicates, model_index, init_facts,
+                          type_to_objects)
     with timers.timing("Completing instantiation"):
-        return instantiate(task, model)
+        return instantiate(task, model_index, fluent_predicates,
+                           init_facts, init_assignments, type_to_objects)
 
 
 if __name__ == "__main__":
@@ -31,6 +31,14 @@ def parse_args():
     argparser.add_argument(
         "--invariant-generation-max-time", default=300, type=int,
         help="max time for invariant generation (default: %(default)ds)")
+    argparser.add_argument(
+        "--instantiation-processes", default=1, type=int,
+        help="number of processes used for instantiating actions and axioms "
+        "(default: %(default)d). Multiple processes only pay off for "
+        "tasks with many reachable actions and are only used on Linux with "
+        "Python >= 3.7; otherwise the instantiation runs serially. Note "
+        "that the translator time and memory limits apply to each process "
+        "separately.")
     argparser.add_argument(
         "--add-implied-preconditions", action="store_true",
         help="infer additional preconditions. This setting can cause a "
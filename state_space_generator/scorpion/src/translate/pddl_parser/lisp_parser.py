@@ -1,3 +1,5 @@
+import sys
+
 __all__ = ["ParseError", "parse_nested_list"]
 
 class ParseError(Exception):
@@ -27,7 +29,11 @@ def tokenize(input):
                              line[0:-1])
         line = line.replace("(", " ( ").replace(")", " ) ").replace("?", " ?")
         for token in line.split():
-            yield token.lower()
+            # Intern the tokens, so that all occurrences of a name share
+            # one string object. Names are used as set and dict keys
+            # throughout the translator, and equal keys are then
+            # recognized by identity without comparing the strings.
+            yield sys.intern(token.lower())
 
 def parse_list_aux(tokenstream):
     # Leading "(" has already been swallowed.
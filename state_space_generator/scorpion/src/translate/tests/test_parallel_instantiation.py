@@ -0,0 +1,60 @@
+import os.path
+import subprocess
+import sys
+
+import pytest
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+TRANSLATE_DIR = os.path.dirname(DIR)
+REPO = os.path.abspath(os.path.join(DIR, "..", "..", ".."))
+BENCHMARKS = os.path.join(REPO, "misc", "tests", "benchmarks")
+# Philosophers has axioms, so both kinds of chunks are instantiated.
+TASKS = [
+    ("gripper", "prob01.pddl"),
+    ("philosophers", "p01-phil2.pddl"),
+]
+PARALLEL_MARKER = "Instantiating in parallel."
+
+# Run the translator with the threshold for parallel instantiation
+# disabled, since all bundled benchmarks are below it.
+PARALLEL_TRANSLATE = f"""
+import runpy
+import sys
+sys.path.insert(0, {TRANSLATE_DIR!r})
+import instantiate
+instantiate.MIN_ATOMS_FOR_PARALLEL_INSTANTIATION = 0
+instantiate_in_parallel = instantiate._instantiate_in_parallel
+def _instantiate_in_parallel(*args):
+    print({PARALLEL_MARKER!r})
+    return instantiate_in_parallel(*args)
+instantiate._instantiate_in_parallel = _instantiate_in_parallel
+sys.argv[0] = {os.path.join(TRANSLATE_DIR, "translate.py")!r}
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def translate(cmd, domain, problem, sas_file, cwd):
+    output = subprocess.check_output(
+        cmd + [domain, problem, "--sas-file", sas_file],
+        cwd=cwd, universal_newlines=True)
+    with open(sas_file) as f:
+        return output, f.read()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux") or
+                    sys.version_info < (3, 7),
+                    reason="parallel instantiation requires Linux and "
+                    "Python >= 3.7")
+def test_parallel_instantiation(tmp_path):
+    for domain_dir, problem in TASKS:
+        domain = os.path.join(BENCHMARKS, domain_dir, "domain.pddl")
+        problem = os.path.join(BENCHMARKS, domain_dir, problem)
+        _, serial_sas = translate(
+            [sys.executable, os.path.join(TRANSLATE_DIR, "translate.py")],
+            domain, problem, str(tmp_path / "serial.sas"), tmp_path)
+        output, parallel_sas = translate(
+            [sys.executable, "-c", PARALLEL_TRANSLATE,
+             "--instantiation-processes", "2"],
+            domain, problem, str(tmp_path / "parallel.sas"), tmp_path)
+        assert PARALLEL_MARKER in output
+        assert parallel_sas == serial_sas
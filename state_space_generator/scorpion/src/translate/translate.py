@@ -12,6 +12,7 @@ if not python_version_supported():
     sys.exit("Error: Translator only supports Python >= 3.6.")
 
 
+import concurrent.futures.process
 from collections import defaultdict
 from copy import deepcopy
 from itertools import product
@@ -47,6 +48,7 @@ DEBUG = False
 ## we only list codes that are used by the translator component of the planner.
 TRANSLATE_OUT_OF_MEMORY = 20
 TRANSLATE_OUT_OF_TIME = 21
+TRANSLATE_CRITICAL_ERROR = 30
 
 simplified_effect_condition_counter = 0
 added_implied_precondition_counter = 0
@@ -824,3 +826,14 @@ if __name__ == "__main__":
         traceback.print_exc(file=sys.stdout)
         print("=" * 79)
         sys.exit(TRANSLATE_OUT_OF_MEMORY)
+    except concurrent.futures.process.BrokenProcessPool:
+        # The time and memory limits apply to each worker process of
+        # the instantiation, and a worker that hits one of them is
+        # killed without us being able to tell why.
+        print()
+        print("A worker process of the translator terminated abruptly, "
+              "possibly because it hit the time or memory limit, traceback:")
+        print("=" * 79)
+        traceback.print_exc(file=sys.stdout)
+        print("=" * 79)
+        sys.exit(TRANSLATE_CRITICAL_ERROR)
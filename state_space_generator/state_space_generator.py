@@ -12,9 +12,11 @@ def build_callstring(max_time: float, max_num_states: int):
     result +=  ")"
     return result
 
-def generate_state_space(domain: str, problem: str, max_time: str = None, max_num_states: int=None):
+def generate_state_space(domain: str, problem: str, max_time: str = None, max_num_states: int=None, python: str = "python3"):
+    # The driver runs the translator with the same interpreter, so passing
+    # e.g. python="pypy3" speeds up translating large tasks.
     command = [
-        "python3",
+        python,
         Path(HERE / 'scorpion/fast-downward.py').resolve(),
         "--keep-sas-file",
         Path(domain).resolve(),